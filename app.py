@@ -1,28 +1,70 @@
-from flask import Flask, request, jsonify, render_template
+from quart import Quart, request, jsonify, render_template, make_response
+from quart.json.provider import JSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
-import base64
-import json
+import asyncio
+import pybase64
+import hashlib
+import httpx
+import io
+import orjson
 import logging
+import logging.handlers
+import queue
+import sys
+import atexit
 import traceback
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIError, APIConnectionError, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception, stop_after_attempt, stop_before_delay, wait_exponential_jitter, before_sleep_log
+from arq import create_pool
+from arq.connections import RedisSettings
+from arq.jobs import Job, JobStatus
 from dotenv import load_dotenv
+from PIL import Image, ImageOps, ImageStat, UnidentifiedImageError
 import time
+import uuid
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: request code only enqueues records, a listener thread does the I/O.
+# Logs go to stdout only; the platform running the Procfile collects and retains them, so no
+# process writes (or has to rotate) a local log file.
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.StreamHandler(sys.stdout)
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+root_logger = logging.getLogger()
+root_logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+class ORJSONProvider(JSONProvider):
+    """JSON provider that serialises responses and parses request bodies with orjson."""
+    
+    mimetype = "application/json"
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE), mimetype=self.mimetype)
+
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+
+# Cap request bodies so an oversized upload can't exhaust worker memory
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", "16")) * 1024 * 1024
 
 # Get API key from environment variable
 api_key = os.getenv("OPENAI_API_KEY")
@@ -30,205 +72,815 @@ if not api_key:
     logger.error("No OpenAI API key found in environment variables")
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-client = OpenAI(api_key=api_key)
+# Seconds the OpenAI client waits on a connection or read before giving up
+OPENAI_TIMEOUT = 60.0
+
+# Retries are handled by tenacity below, so the SDK's own retry loop is disabled.
+# One pooled HTTP/2 client multiplexes concurrent requests over a few kept-alive connections.
+client = AsyncOpenAI(
+    api_key=api_key,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        timeout=OPENAI_TIMEOUT,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+)
 logger.info("OpenAI client initialized")
 
+# Extraction jobs are queued in Redis and executed by arq workers
+redis_settings = RedisSettings.from_dsn(os.getenv("REDIS_URL", "redis://localhost:6379"))
+redis_pool = None
+JOB_POLL_INTERVAL = 0.5
+
+# A job that hasn't started within JOB_QUEUE_TIMEOUT seconds is dropped, and one that runs
+# longer than JOB_TIMEOUT is cancelled, so nobody waits on a job for longer than their sum
+JOB_QUEUE_TIMEOUT = 60
+JOB_TIMEOUT = 180
+JOB_DEADLINE = JOB_QUEUE_TIMEOUT + JOB_TIMEOUT
+
+# Streaming progress is written at most every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL = 0.25
+PROGRESS_TTL = 300
+
+# Successful extractions are cached by image hash for a day
+CACHE_TTL = 86400
+
+# Batches created by this app are remembered for a week (the batch window itself is 24h)
+BATCH_TTL = 7 * 86400
+# Batch states whose output and error files hold (possibly partial) results
+BATCH_FINAL_STATUSES = {"completed", "expired", "cancelled"}
+
+# Images are downscaled before they are sent to OpenAI
+IMAGE_MAX_DIMENSION = 1024
+IMAGE_JPEG_QUALITY = 85
+IMAGE_DETAIL = os.getenv("OPENAI_IMAGE_DETAIL", "low")
+
+# Photos below these limits are rejected locally as unreadable
+MIN_IMAGE_PIXELS = 100_000
+# Photos above this are refused before decoding to bound per-request memory
+MAX_IMAGE_PIXELS = 50_000_000
+MIN_IMAGE_CONTRAST = 10
+
+def prepare_image(image_bytes):
+    """Downscale an uploaded photo and re-encode it as a base64 JPEG to cut upload size and image tokens.
+    
+    Also screens the photo for problems that make a readable license impossible, returning
+    (image_data, issues) where issues is empty when the photo looks usable.
+    """
+    issues = []
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # Only the header has been read so far; refuse huge images before any pixels are decoded
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image has {img.width * img.height} pixels, the limit is {MAX_IMAGE_PIXELS}"
+            )
+        if img.width * img.height < MIN_IMAGE_PIXELS:
+            issues.append("Image resolution is too low")
+        # Decode JPEGs at a reduced scale and shrink before making any full-size copies
+        img.draft("RGB", (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        # A blank, black or completely washed out photo has almost no brightness variation
+        if ImageStat.Stat(img.convert("L")).stddev[0] < MIN_IMAGE_CONTRAST:
+            issues.append("Image is blank or has too little contrast")
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    return pybase64.b64encode(output.getvalue()).decode("ascii"), issues
+
+def build_no_license_response(issues=None):
+    """Build the feedback payload returned when no license can be read from the photo."""
+    # Suggestions to help the user take a better photo
+    suggestions = [
+        "Make sure your driver's license is visible in the image",
+        "Ensure good lighting with minimal glare",
+        "Hold the license parallel to the camera",
+        "Use a contrasting background"
+    ]
+    
+    return {
+        "status": "error",
+        "message": "Could not clearly detect a driver's license in the image",
+        "analysis": {
+            "license_detected": False,
+            "issues": issues or []
+        },
+        "suggestions": suggestions
+    }
+
+# The static parts of the extraction prompt are built once; only the image part changes per request.
+# The system prompt is kept above 1024 tokens and placed first so OpenAI's automatic prompt caching
+# can reuse it across requests; the image must stay the last part of the messages.
+# Raw string so the JSON escapes in the examples (\n, \") reach the model unchanged
+LICENSE_SYSTEM_PROMPT = r"""You are a specialized assistant that extracts information from driver's license images.
+
+First, identify the driver's license in the image - it will be a rectangular card with text and possibly a photo.
+Even if the license only takes up a small portion of the image or has a busy background, focus only on the license.
+
+Once you've located the license in the image:
+1. Extract all visible text from ONLY the license portion
+2. Ignore any text that is not on the license itself
+3. Identify structured information for these fields if present:
+   - LIC# (License Number)
+   - Name (Full name as it appears)
+   - DOB (Date of Birth)
+   - Issue Date
+   - Expiration Date
+   - Address (Full address including city, state, zip)
+   - Sex
+   - Height
+   - Weight
+   - Eyes (Eye color)
+   - Restriction
+   - Class (License class)
+   - DD# (Document Discriminator Number)
+   - Donor status
+   - Revision date
+
+Respond with a single JSON object with exactly these keys:
+- "license_detected": true if a driver's license is visible in the image, otherwise false
+- "raw_text": all text extracted from the license, formatted clearly with one item per line
+- "fields": an object mapping each field name above (e.g. "LIC#", "Name", "DOB") to its value as a string
+
+If you can't find information for a field, don't include it in "fields".
+Don't make up information or guess. Extract only what's clearly present on the license.
+If you cannot find a driver's license in the image, set "license_detected" to false and leave "raw_text" empty and "fields" empty.
+
+FIELD REFERENCE
+Most U.S. licenses follow the AAMVA card design standard, which numbers the printed fields. Use these labels to map
+text on the card to the field names above. The numbers may or may not be printed next to the values.
+- LIC#: labelled "DL", "DLN", "LIC#", "License No", "ID No" or "4d". Copy it exactly, keeping letters, digits,
+  dashes and spaces as printed. Never confuse it with the DD# or an inventory/audit number.
+- Name: labelled "1" (family name) and "2" (given names), sometimes printed on two lines. Combine them in the order
+  shown on the card (for example "SMITH JOHN ROBERT" or "JOHN ROBERT SMITH"), including suffixes such as JR or III.
+- DOB: labelled "DOB" or "3". Keep the date format printed on the card, usually MM/DD/YYYY.
+- Issue Date: labelled "ISS", "Issued" or "4a".
+- Expiration Date: labelled "EXP", "Expires" or "4b".
+- Address: labelled "8" or printed under the name without a label. Join street, city, state and ZIP into one line
+  separated by commas, for example "123 MAIN ST, SPRINGFIELD, IL 62701".
+- Sex: labelled "SEX" or "15". Usually "M", "F" or "X".
+- Height: labelled "HGT" or "16". Keep the printed form, for example "5'-10\"" or "070 in".
+- Weight: labelled "WGT" or "17". Keep the printed value and unit, for example "180 lb".
+- Eyes: labelled "EYES" or "18". Keep the printed abbreviation, for example "BRO", "BLU" or "HAZ".
+- Restriction: labelled "RESTR", "R" or "12". Use "NONE" only if the card prints "NONE".
+- Class: labelled "CLASS" or "9", for example "C", "D" or "M".
+- DD#: labelled "DD", "Document Discriminator" or "5". It is often a long alphanumeric string near the bottom.
+- Donor status: present when the card shows "DONOR", a heart symbol with text, or an organ donor indicator.
+  Use "Yes" when such an indicator is visible; leave the field out otherwise.
+- Revision date: labelled "REV", "Rev" or "Revised", usually printed in small type along an edge of the card.
+
+RAW TEXT RULES
+- Include every legible line of text printed on the license, top to bottom, left to right.
+- Keep each label with its value on the same line, for example "4b EXP 05/14/2029".
+- Include headers such as the state name, "DRIVER LICENSE", "USA" and "REAL ID" markers.
+- Do not include text from the background, the table, a hand, a wallet or any other card.
+- Do not describe the photo, signature or security features; only transcribe text.
+
+COMMON MISTAKES TO AVOID
+- Reading the letter "O" as the digit "0", "I" as "1" or "S" as "5" inside license numbers. Prefer what the card's
+  typeface shows, and use the state's usual number format only as a tie-breaker.
+- Swapping the issue and expiration dates. The expiration date is always later than the issue date.
+- Using the date of birth printed in a ghost image or a vertical "UNDER 21 UNTIL" banner as a separate field.
+  Those banners belong in "raw_text" only.
+- Copying the DD# or a barcode number into "LIC#".
+- Guessing values that are covered by glare, fingers or blur. Leave such fields out instead.
+- Returning anything other than the JSON object, such as explanations or Markdown code fences.
+
+EXAMPLE
+For a clear photo of a license, the response looks like this (all values here are fictional):
+{
+  "license_detected": true,
+  "raw_text": "ILLINOIS\nDRIVER'S LICENSE\n4d DLN S123-4567-8901\n1 SAMPLE\n2 JANE A\n8 123 MAIN ST\nSPRINGFIELD, IL 62701\n3 DOB 01/02/1990\n4a ISS 03/04/2022\n4b EXP 01/02/2030\n15 SEX F 16 HGT 5'-06\"\n17 WGT 130 lb 18 EYES BRO\n9 CLASS D 12 RESTR NONE\n5 DD 20220304123456789012",
+  "fields": {
+    "LIC#": "S123-4567-8901",
+    "Name": "JANE A SAMPLE",
+    "DOB": "01/02/1990",
+    "Issue Date": "03/04/2022",
+    "Expiration Date": "01/02/2030",
+    "Address": "123 MAIN ST, SPRINGFIELD, IL 62701",
+    "Sex": "F",
+    "Height": "5'-06\"",
+    "Weight": "130 lb",
+    "Eyes": "BRO",
+    "Restriction": "NONE",
+    "Class": "D",
+    "DD#": "20220304123456789012"
+  }
+}
+
+For a photo that does not show a driver's license, the response is:
+{
+  "license_detected": false,
+  "raw_text": "",
+  "fields": {}
+}
+"""
+
+LICENSE_SYSTEM_MESSAGE = {"role": "system", "content": LICENSE_SYSTEM_PROMPT}
+LICENSE_USER_TEXT_PART = {
+    "type": "text",
+    "text": "Extract the information from the driver's license in this image, ignoring any background:"
+}
+
+def build_license_messages(image_data):
+    """Build the chat messages that ask GPT-4o to extract license information from a base64 JPEG."""
+    return [
+        LICENSE_SYSTEM_MESSAGE,
+        {
+            "role": "user",
+            "content": [
+                LICENSE_USER_TEXT_PART,
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}", "detail": IMAGE_DETAIL}}
+            ]
+        }
+    ]
+
+def build_license_request(image_data):
+    """Build the chat completion parameters for a license extraction request."""
+    return {
+        "model": "gpt-4o",
+        "messages": build_license_messages(image_data),
+        "response_format": {"type": "json_object"},
+        "max_tokens": 1000
+    }
+
+class RateLimiter:
+    """Token bucket for OpenAI requests and tokens per minute, resynced from x-ratelimit-* response headers."""
+    
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_capacity / 60)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_capacity / 60)
+    
+    async def acquire(self, tokens):
+        """Wait until one request and the given number of tokens are available, then take them."""
+        tokens = min(tokens, self.token_capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self.requests) * 60 / self.request_capacity,
+                    (tokens - self.tokens) * 60 / self.token_capacity
+                )
+                logger.debug("OpenAI rate limiter waiting %.2f seconds", wait)
+                await asyncio.sleep(wait)
+    
+    def update_from_headers(self, headers):
+        """Lower the buckets to what OpenAI reports as remaining for this API key."""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        self._refill()
+        try:
+            if remaining_requests is not None:
+                self.requests = min(self.requests, float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens = min(self.tokens, float(remaining_tokens))
+        except ValueError:
+            logger.warning("Unexpected OpenAI rate limit headers: %s, %s", remaining_requests, remaining_tokens)
+
+# Bound concurrent OpenAI calls and smooth dispatch under the account's RPM/TPM limits
+openai_semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "10")))
+openai_rate_limiter = RateLimiter(
+    int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+    int(os.getenv("OPENAI_TPM_LIMIT", "30000"))
+)
+
+# Rough token cost of one image in the extraction prompt; low detail images have a fixed cost
+IMAGE_TOKEN_ESTIMATE = 1000
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+def estimate_request_tokens(params):
+    """Estimate how many tokens a chat completion counts against the TPM limit."""
+    tokens = params.get("max_tokens", 0)
+    for message in params["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // 4
+            elif part["image_url"].get("detail") == "low":
+                tokens += LOW_DETAIL_IMAGE_TOKENS
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+def log_usage(usage):
+    """Log token usage, including how much of the prompt was served from OpenAI's prompt cache."""
+    details = usage.prompt_tokens_details
+    cached_tokens = details.cached_tokens if details and details.cached_tokens else 0
+    logger.info(
+        "OpenAI usage: %s prompt tokens (%s cached), %s completion tokens",
+        usage.prompt_tokens, cached_tokens, usage.completion_tokens
+    )
+
+OPENAI_RETRY_BUDGET = JOB_TIMEOUT - OPENAI_TIMEOUT
+
+openai_backoff = wait_exponential_jitter(initial=1, max=30)
+
+def wait_openai_retry(retry_state):
+    """Honour OpenAI's retry-after header on 429s, otherwise back off exponentially with jitter."""
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, RateLimitError):
+        retry_after = exc.response.headers.get("retry-after")
+        try:
+            return min(float(retry_after), 60.0)
+        except (TypeError, ValueError):
+            pass
+    return openai_backoff(retry_state)
+
+def is_retryable_openai_error(exc):
+    """Decide whether an OpenAI failure is transient, including errors raised part-way through a stream."""
+    # APITimeoutError is a subclass of APIConnectionError. Transport errors (read timeouts, dropped
+    # connections) raised while iterating a stream are not wrapped by the SDK, so they arrive as httpx errors.
+    if isinstance(exc, (RateLimitError, APIConnectionError, InternalServerError, httpx.TransportError)):
+        return True
+    # An error event inside a stream is raised as a bare APIError with no HTTP status
+    return type(exc) is APIError
+
+@retry(
+    retry=retry_if_exception(is_retryable_openai_error),
+    wait=wait_openai_retry,
+    # No retry starts so late that a full-length attempt would overrun the job timeout
+    stop=stop_after_attempt(5) | stop_before_delay(OPENAI_RETRY_BUDGET),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+async def stream_chat_completion(on_progress=None, **kwargs):
+    """Stream a chat completion and return its full content, retrying transient OpenAI failures (429, 5xx, timeouts).
+    
+    on_progress is awaited with the content received so far as chunks arrive.
+    """
+    async with openai_semaphore:
+        await openai_rate_limiter.acquire(estimate_request_tokens(kwargs))
+        raw_response = await client.chat.completions.with_raw_response.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+        openai_rate_limiter.update_from_headers(raw_response.headers)
+        
+        # The context manager closes the HTTP stream even if iteration is interrupted
+        content = []
+        async with raw_response.parse() as stream:
+            async for chunk in stream:
+                if chunk.usage:
+                    log_usage(chunk.usage)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                content.append(chunk.choices[0].delta.content)
+                if on_progress:
+                    await on_progress(content)
+        return "".join(content)
+
+def format_license_fields(fields):
+    """Normalise the model's "fields" object into non-empty string values, dropping anything malformed."""
+    if not isinstance(fields, dict):
+        return {}
+    formatted_data = {}
+    for key, value in fields.items():
+        if value is None or isinstance(value, (dict, list)):
+            continue
+        value = str(value).strip()
+        if value:
+            formatted_data[str(key).strip()] = value
+    return formatted_data
+
+async def run_extraction(ctx, image_data, force_extraction=False, cache_key=None):
+    """Worker job: run the GPT-4o license extraction for a base64 JPEG and return the response payload."""
+    job_start_time = time.time()
+    
+    # Publish how much of the response has arrived so the browser can show live progress
+    progress_key = f"dl:progress:{ctx['job_id']}"
+    last_progress_time = 0
+    
+    async def publish_progress(content):
+        nonlocal last_progress_time
+        now = time.monotonic()
+        if now - last_progress_time < PROGRESS_INTERVAL:
+            return
+        last_progress_time = now
+        await ctx['redis'].setex(progress_key, PROGRESS_TTL, sum(len(part) for part in content))
+    
+    # Use GPT-4o to detect the license and extract both raw text and structured fields in one call
+    logger.info("Sending image to OpenAI for license detection and information extraction")
+    extraction_start_time = time.time()
+    
+    try:
+        license_info = await stream_chat_completion(publish_progress, **build_license_request(image_data))
+        extraction_time = time.time() - extraction_start_time
+        logger.debug("License extraction completed in %.2f seconds", extraction_time)
+        
+        # The response is a JSON object thanks to JSON mode
+        logger.info("License info extracted (%s characters)", len(license_info))
+        logger.debug("License info content: %s", license_info)
+        result = orjson.loads(license_info)
+        if not isinstance(result, dict):
+            raise TypeError("model response is not a JSON object")
+        
+    except Exception as e:
+        logger.error("Error in OpenAI license extraction: %s", e)
+        logger.error(traceback.format_exc())
+        return {"status": "error", "message": f"OpenAI license extraction failed: {str(e)}"}
+    
+    extracted_text = result.get("raw_text") or ""
+    formatted_data = format_license_fields(result.get("fields"))
+    
+    # Check if no license was detected
+    if not result.get("license_detected") and not force_extraction:
+        return build_no_license_response()
+    
+    # If no structured data was found, use the extracted raw text
+    if not formatted_data:
+        logger.warning("No structured license data found, using raw text")
+        formatted_data = {"Raw Extracted Text": extracted_text}
+    
+    # Log the final result
+    total_time = time.time() - job_start_time
+    logger.info("Total processing completed in %.2f seconds", total_time)
+    logger.info("Returning %s fields of license data", len(formatted_data))
+    
+    payload = {
+        "status": "success", 
+        "data": formatted_data,
+        "raw_text": extracted_text,
+        "license_info": license_info,
+        "processing_time": {
+            "extraction_time": f"{extraction_time:.2f}s",
+            "total_time": f"{total_time:.2f}s"
+        }
+    }
+    
+    # Only cache real detections so a forced extraction never answers a later normal scan
+    if cache_key and result.get("license_detected"):
+        await ctx['redis'].setex(f"dl:{cache_key}", CACHE_TTL, orjson.dumps(payload))
+        logger.debug("Cached license info under dl:%s", cache_key)
+    
+    return payload
+
+async def get_job_payload(job_id):
+    """Return the current state of an extraction job as a response payload."""
+    job = Job(job_id, redis_pool)
+    job_status = await job.status()
+    
+    if job_status == JobStatus.not_found:
+        return {"status": "error", "message": "Extraction job not found"}
+    
+    if job_status != JobStatus.complete:
+        # Stop waiting on jobs that no worker picked up or that outlived the worker's timeout
+        job_info = await job.info()
+        if job_info and time.time() - job_info.enqueue_time.timestamp() > JOB_DEADLINE:
+            logger.error("Extraction job %s still %s after %s seconds", job_id, job_status.value, JOB_DEADLINE)
+            return {"status": "error", "message": "License extraction timed out, please try again"}
+        
+        received = await redis_pool.get(f"dl:progress:{job_id}")
+        return {
+            "status": "pending",
+            "job_id": job_id,
+            "job_status": job_status.value,
+            "received_characters": int(received) if received else 0
+        }
+    
+    job_result = await job.result_info()
+    if not job_result.success:
+        logger.error("Extraction job %s failed: %r", job_id, job_result.result)
+        # arq cancels jobs that run past job_timeout with an empty TimeoutError
+        if isinstance(job_result.result, asyncio.TimeoutError):
+            return {"status": "error", "message": "License extraction timed out, please try again"}
+        return {"status": "error", "message": f"Server error: {job_result.result or type(job_result.result).__name__}"}
+    
+    return job_result.result
+
+async def warm_up_openai():
+    """Open a pooled connection to OpenAI (DNS, TCP and TLS) before the first real request needs it."""
+    start_time = time.time()
+    try:
+        await client.models.list()
+        logger.info("OpenAI connection warmed up in %.2f seconds", time.time() - start_time)
+    except Exception as e:
+        logger.warning("OpenAI warm-up failed: %s", e)
+
+@app.before_serving
+async def startup():
+    global redis_pool
+    redis_pool = await create_pool(redis_settings)
+    logger.info("Redis job queue connected")
+
+@app.after_serving
+async def shutdown():
+    await redis_pool.aclose()
+    await client.close()
+
 @app.route('/')
-def index():
+async def index():
     logger.debug("Serving index page")
-    return render_template("index.html")
+    return await render_template("index.html")
 
 @app.route('/extract', methods=['POST'])
-def extract_text():
-    request_start_time = time.time()
+async def extract_text():
     logger.debug("Received /extract request")
     
     try:
-        # Get the image data from the request
-        data = request.json
-        if not data:
-            logger.error("No JSON data in request")
-            return jsonify({"status": "error", "message": "No JSON data provided"})
+        if request.mimetype == 'multipart/form-data':
+            # The browser uploads the raw image file, avoiding the base64 overhead
+            files = await request.files
+            if 'image' not in files:
+                logger.error("No image file in request")
+                return jsonify({"status": "error", "message": "No image data provided"})
+            
+            image_bytes = files['image'].read()
+            logger.debug("Received image file of size: %s", len(image_bytes))
+            
+            form = await request.form
+            force_extraction = form.get('force_extraction') == 'true'
+        else:
+            # API clients can still send the image as a base64 string in JSON
+            data = await request.get_json()
+            if not data:
+                logger.error("No JSON data in request")
+                return jsonify({"status": "error", "message": "No JSON data provided"})
+            
+            logger.debug("Request data keys: %s", list(data.keys()))
+            
+            if 'image' not in data:
+                logger.error("No image key in request data")
+                return jsonify({"status": "error", "message": "No image data provided"})
+            
+            image_data = data['image']
+            logger.debug("Received image data of length: %s", len(image_data))
+            
+            # If the image starts with the data URL prefix, remove it
+            if image_data.startswith('data:image'):
+                logger.debug("Image data contains prefix, removing it")
+                # Slice after the comma rather than split(), which would copy the whole payload into a list
+                image_data = image_data[image_data.find(',', 0, 64) + 1:]
+            
+            try:
+                image_bytes = pybase64.b64decode(image_data, validate=True)
+            except ValueError:
+                # binascii.Error for bad base64, plain ValueError for non-ASCII input
+                logger.error("Image data is not valid base64")
+                return jsonify({"status": "error", "message": "Invalid image data"})
+            
+            force_extraction = data.get('force_extraction', False)
+        
+        # Re-uploads of the same photo are answered from the cache without calling OpenAI
+        cache_key = hashlib.sha256(image_bytes).hexdigest()
+        cached = await redis_pool.get(f"dl:{cache_key}")
+        if cached:
+            logger.info("Returning cached license info for dl:%s", cache_key)
+            # The cached payload is already serialised JSON, so it is sent as-is
+            return app.response_class(cached, mimetype="application/json")
+        
+        try:
+            image_data, issues = await asyncio.to_thread(prepare_image, image_bytes)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            logger.error("Could not read uploaded image: %s", e)
+            return jsonify({"status": "error", "message": "Invalid image data"})
+        logger.debug("Prepared image data of length: %s", len(image_data))
+        
+        # Photos that cannot contain a readable license are rejected without calling OpenAI
+        if issues and not force_extraction:
+            logger.info("Rejected image before extraction: %s", "; ".join(issues))
+            return jsonify(build_no_license_response(issues))
         
-        logger.debug(f"Request data keys: {list(data.keys())}")
+        # Hand the OpenAI work to the queue workers and return immediately
+        job = await redis_pool.enqueue_job(
+            "run_extraction", image_data, force_extraction, cache_key,
+            _expires=JOB_QUEUE_TIMEOUT
+        )
+        logger.info("Queued extraction job %s", job.job_id)
         
-        if 'image' not in data:
-            logger.error("No image key in request data")
+        return jsonify({"status": "queued", "job_id": job.job_id})
+        
+    except RequestEntityTooLarge:
+        logger.error("Upload exceeded the %s byte limit", app.config['MAX_CONTENT_LENGTH'])
+        return jsonify({"status": "error", "message": "Image is too large"}), 413
+        
+    except Exception as e:
+        logger.error("Unhandled exception in /extract endpoint: %s", e)
+        logger.error(traceback.format_exc())
+        return jsonify({"status": "error", "message": f"Server error: {str(e)}"})
+
+@app.route('/extract/<job_id>', methods=['GET'])
+async def extract_result(job_id):
+    """Poll an extraction job for its status or result."""
+    try:
+        return jsonify(await get_job_payload(job_id))
+    except Exception as e:
+        logger.error("Error reading extraction job %s: %s", job_id, e)
+        logger.error(traceback.format_exc())
+        return jsonify({"status": "error", "message": f"Server error: {str(e)}"})
+
+@app.route('/extract/<job_id>/events', methods=['GET'])
+async def extract_events(job_id):
+    """Push the result of an extraction job to the browser as server-sent events."""
+    async def send_events():
+        while True:
+            try:
+                payload = await get_job_payload(job_id)
+            except Exception as e:
+                logger.error("Error reading extraction job %s: %s", job_id, e)
+                payload = {"status": "error", "message": f"Server error: {str(e)}"}
+            yield b"data: " + orjson.dumps(payload) + b"\n\n"
+            if payload["status"] != "pending":
+                break
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+    
+    response = await make_response(send_events(), {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    response.timeout = None
+    return response
+
+@app.route('/extract_batch', methods=['POST'])
+async def extract_batch():
+    """Submit many license images to the OpenAI Batch API for offline processing."""
+    logger.debug("Received /extract_batch request")
+    
+    try:
+        data = await request.get_json()
+        if not data or not data.get('images'):
+            logger.error("No images in batch request")
             return jsonify({"status": "error", "message": "No image data provided"})
         
-        # The image comes as a base64 string
-        image_data = data['image']
-        logger.debug(f"Received image data of length: {len(image_data)}")
+        if not isinstance(data['images'], list) or not all(isinstance(image, str) for image in data['images']):
+            logger.error("Batch images are not a list of base64 strings")
+            return jsonify({"status": "error", "message": "Images must be a list of base64 strings"})
         
-        # If the image starts with the data URL prefix, remove it
-        if image_data.startswith('data:image'):
-            logger.debug("Image data contains prefix, removing it")
-            image_data = image_data.split(',')[1]
+        # Write one chat completion request per image as a JSONL line
+        custom_ids = []
+        lines = []
+        for image_data in data['images']:
+            if image_data.startswith('data:image'):
+                image_data = image_data[image_data.find(',', 0, 64) + 1:]
+            try:
+                image_bytes = pybase64.b64decode(image_data, validate=True)
+                image_data, _ = await asyncio.to_thread(prepare_image, image_bytes)
+            except (ValueError, UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+                logger.error("Could not read batch image: %s", e)
+                return jsonify({"status": "error", "message": "Invalid image data"})
+            custom_id = str(uuid.uuid4())
+            custom_ids.append(custom_id)
+            lines.append(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_license_request(image_data)
+            }))
         
-        # Force extraction flag
-        force_extraction = data.get('force_extraction', False)
+        logger.info("Uploading batch input file with %s requests", len(lines))
+        batch_file = await client.files.create(
+            file=("licenses.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info("Created batch %s", batch.id)
         
-        # Step 1: Use GPT-4o to detect license, crop conceptually, and extract text
-        logger.info("Sending image to OpenAI for license detection and text extraction")
-        extraction_start_time = time.time()
+        # Remember which batches this app created so status lookups can't read other batches on the account
+        await redis_pool.setex(f"dl:batch:{batch.id}", BATCH_TTL, orjson.dumps(custom_ids))
         
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a specialized assistant that extracts text from driver's license images.
-                        
-                        First, identify the driver's license in the image - it will be a rectangular card with text and possibly a photo.
-                        Even if the license only takes up a small portion of the image or has a busy background, focus only on the license.
-                        
-                        Once you've located the license in the image:
-                        1. Extract all visible text from ONLY the license portion
-                        2. Ignore any text that is not on the license itself
-                        3. Format the extracted text clearly
-                        
-                        If you cannot find a driver's license in the image, respond with only: "NO_LICENSE_DETECTED"
-                        """
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Extract all text from the driver's license in this image, ignoring any background:"},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-                        ]
-                    }
-                ],
-                max_tokens=500
-            )
-            extraction_time = time.time() - extraction_start_time
-            logger.debug(f"Text extraction completed in {extraction_time:.2f} seconds")
-            
-            # Extract the response text
-            extracted_text = response.choices[0].message.content
-            logger.info(f"Extracted text ({len(extracted_text)} characters)")
-            logger.debug(f"Extracted text content: {extracted_text}")
-            
-            # Check if no license was detected
-            if extracted_text.strip() == "NO_LICENSE_DETECTED" and not force_extraction:
-                # Return feedback to help user take a better photo
-                suggestions = [
-                    "Make sure your driver's license is visible in the image",
-                    "Ensure good lighting with minimal glare",
-                    "Hold the license parallel to the camera",
-                    "Use a contrasting background"
-                ]
-                
-                return jsonify({
-                    "status": "error",
-                    "message": "Could not clearly detect a driver's license in the image",
-                    "analysis": {
-                        "license_detected": False
-                    },
-                    "suggestions": suggestions
-                })
-            
-        except Exception as e:
-            logger.error(f"Error in OpenAI text extraction: {str(e)}")
-            logger.error(traceback.format_exc())
-            return jsonify({"status": "error", "message": f"OpenAI text extraction failed: {str(e)}"})
+        return jsonify({
+            "status": "success",
+            "batch_id": batch.id,
+            "batch_status": batch.status,
+            "custom_ids": custom_ids
+        })
         
-        # Step 2: Process the extracted text to identify driver's license information
-        logger.info("Processing extracted text for license information")
-        license_start_time = time.time()
+    except Exception as e:
+        logger.error("Error creating OpenAI batch: %s", e)
+        logger.error(traceback.format_exc())
+        return jsonify({"status": "error", "message": f"OpenAI batch creation failed: {str(e)}"})
+
+def parse_batch_result(item):
+    """Turn one line of a batch output or error file into a per-image result."""
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        body = response.get("body") or {}
+        error = item.get("error") or body.get("error") or body
+        message = error.get("message") if isinstance(error, dict) else None
+        return {"status": "error", "message": message or str(error)}
+    
+    # One truncated or malformed model response must not fail the rest of the batch
+    try:
+        license_info = response["body"]["choices"][0]["message"]["content"]
+        result = orjson.loads(license_info)
+        if not isinstance(result, dict):
+            raise TypeError("model response is not a JSON object")
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+        logger.error("Invalid batch result for %s: %s", item["custom_id"], e)
+        return {"status": "error", "message": f"Invalid model response: {str(e)}"}
+    
+    return {
+        "status": "success",
+        "license_detected": bool(result.get("license_detected")),
+        "data": format_license_fields(result.get("fields")),
+        "raw_text": result.get("raw_text") or ""
+    }
+
+@app.route('/extract_batch/<batch_id>', methods=['GET'])
+async def extract_batch_status(batch_id):
+    """Report the status of a batch and return its results once it has completed."""
+    logger.debug("Received /extract_batch/%s request", batch_id)
+    
+    try:
+        if not await redis_pool.exists(f"dl:batch:{batch_id}"):
+            logger.error("Unknown batch id %s", batch_id)
+            return jsonify({"status": "error", "message": "Batch not found"}), 404
         
-        try:
-            license_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a specialized assistant that extracts driver's license information from text.
-                        Analyze the following text and extract structured information for these fields if present:
-                        - LIC# (License Number)
-                        - Name (Full name as it appears)
-                        - DOB (Date of Birth)
-                        - Issue Date
-                        - Expiration Date
-                        - Address (Full address including city, state, zip)
-                        - Sex
-                        - Height
-                        - Weight
-                        - Eyes (Eye color)
-                        - Restriction
-                        - Class (License class)
-                        - DD# (Document Discriminator Number)
-                        - Donor status
-                        - Revision date
-                        
-                        Format your response as key-value pairs with a colon between the key and value, one per line.
-                        If you can't find information for a field, don't include it.
-                        Don't make up information or guess. Extract only what's clearly present in the text."""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Extract driver's license information from this text:\n\n{extracted_text}"
-                    }
-                ],
-                max_tokens=500
-            )
-            license_time = time.time() - license_start_time
-            logger.debug(f"License info extraction completed in {license_time:.2f} seconds")
-            
-            # Extract the processed license information
-            license_info = license_response.choices[0].message.content
-            logger.info(f"License info extracted ({len(license_info)} characters)")
-            logger.debug(f"License info content: {license_info}")
-            
-        except Exception as e:
-            logger.error(f"Error in OpenAI license info extraction: {str(e)}")
-            logger.error(traceback.format_exc())
+        batch = await client.batches.retrieve(batch_id)
+        
+        if batch.status == "failed":
+            # The input file was rejected, so there are no per-image results
+            errors = [error.message for error in (batch.errors.data or [])] if batch.errors else []
             return jsonify({
-                "status": "error", 
-                "message": f"OpenAI license info extraction failed: {str(e)}",
-                "raw_text": extracted_text  # Return the raw text at least
+                "status": "error",
+                "batch_id": batch.id,
+                "batch_status": batch.status,
+                "message": "; ".join(e for e in errors if e) or "OpenAI batch failed"
             })
         
-        # Process the license info text into a structured format
-        logger.debug("Parsing license info into structured format")
-        lines = license_info.split('\n')
-        formatted_data = {}
-        
-        for line in lines:
-            if ':' in line:
-                parts = line.split(':', 1)
-                key = parts[0].strip()
-                value = parts[1].strip()
-                formatted_data[key] = value
-                logger.debug(f"Parsed field: {key} = {value}")
-        
-        # If no structured data was found, use the extracted raw text
-        if not formatted_data:
-            logger.warning("No structured license data found, using raw text")
-            formatted_data = {"Raw Extracted Text": extracted_text}
-        
-        # Log the final result
-        total_time = time.time() - request_start_time
-        logger.info(f"Total processing completed in {total_time:.2f} seconds")
-        logger.info(f"Returning {len(formatted_data)} fields of license data")
+        if batch.status not in BATCH_FINAL_STATUSES:
+            return jsonify({
+                "status": "success",
+                "batch_id": batch.id,
+                "batch_status": batch.status,
+                "request_counts": batch.request_counts.model_dump() if batch.request_counts else None
+            })
+        
+        # Successful requests are in the output file and failed ones in the error file; expired and
+        # cancelled batches return whatever finished. Either file may be missing.
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            output = await client.files.content(file_id)
+            for line in output.content.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                results[item["custom_id"]] = parse_batch_result(item)
+        logger.info("Returning %s results for batch %s", len(results), batch.id)
         
         return jsonify({
-            "status": "success", 
-            "data": formatted_data,
-            "raw_text": extracted_text,
-            "license_info": license_info,
-            "processing_time": {
-                "extraction_time": f"{extraction_time:.2f}s",
-                "license_processing_time": f"{license_time:.2f}s",
-                "total_time": f"{total_time:.2f}s"
-            }
+            "status": "success",
+            "batch_id": batch.id,
+            "batch_status": batch.status,
+            "results": results
         })
         
     except Exception as e:
-        logger.error(f"Unhandled exception in /extract endpoint: {str(e)}")
+        logger.error("Error retrieving OpenAI batch %s: %s", batch_id, e)
         logger.error(traceback.format_exc())
-        return jsonify({"status": "error", "message": f"Server error: {str(e)}"})
+        return jsonify({"status": "error", "message": f"OpenAI batch retrieval failed: {str(e)}"})
+
+async def worker_startup(ctx):
+    # Warm up in the background so the worker starts taking jobs immediately
+    ctx['warm_up'] = asyncio.create_task(warm_up_openai())
+
+async def worker_shutdown(ctx):
+    # Don't close the client under an in-flight warm-up request
+    warm_up = ctx.get('warm_up')
+    if warm_up:
+        warm_up.cancel()
+        try:
+            await warm_up
+        except asyncio.CancelledError:
+            pass
+    await client.close()
+
+class WorkerSettings:
+    """arq worker configuration, run with: arq app.WorkerSettings"""
+    functions = [run_extraction]
+    on_startup = worker_startup
+    on_shutdown = worker_shutdown
+    redis_settings = redis_settings
+    max_jobs = int(os.getenv("WORKER_MAX_JOBS", "10"))
+    job_timeout = JOB_TIMEOUT
+    keep_result = 3600
 
 if __name__ == '__main__':
-    logger.info("Starting Flask application")
-    app.run(debug=True)
+    # Local development only; production runs under Hypercorn (see Procfile)
+    logger.info("Starting Quart application")
+    app.run(debug=os.getenv("QUART_DEBUG") == "1")